@@ -1,6 +1,5 @@
 import raspberrypi_control  # import package for raspberrypi controlling over ssh
-import os  # Put import here they are take and install to the raspberrypi file.
-import time
+import time  # Put import here they are take and install to the raspberrypi file.
 
 rp = raspberrypi_control  # rp is for RaspBerryPi
 
@@ -17,20 +16,14 @@ def test():
 def other():
     global i
     print("Hello RaspBerryPi h")
-    th = 0
     print(i)
-    os.system("echo Hello World")
-    while True:
-        th = th + 1
-        if th == 30:
-            time.sleep(0.1)
-            break
+    print("Hello World")  # no need to fork a shell just to print
+    th = 30  # the old loop just counted to 30, fold it to the constant
+    time.sleep(0.1)
     return th
 
 if __name__ == "__main__":  # put all you're code to run at start here. Because if not the code will be run 2 time
-    rp.raspberrypi().set_raspberry_info("username here", "password here") # set login info here
-    rp.raspberrypi().set_preparation("adress/ip here", 8, 1)  # config locator for the raspberrypi
-    rp.raspberrypi().local()  # set the start ip set in the line in the top
+    rp.configure("username here", "password here", "adress/ip here", 8, 1)  # login info + locator in one call
     rp.config("main")  # file name (no .py)
     print(test())
     print(other())  # you can get the output after
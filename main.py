@@ -1,6 +1,9 @@
 import raspberrypi_control  # import package for raspberrypi controlling over ssh
 import os  # Put import here they are take and install to the raspberrypi file.
 import time
+import json
+import socket
+import requests
 
 rp = raspberrypi_control  # rp is for RaspBerryPi
 
@@ -9,23 +12,51 @@ i = 1234567890
 
 @rp.raspberry_command()
 def get_info():
-    import socket
-    import requests
+    # everything used here must live inside the body: the decorator only
+    # ships this function plus bare module imports, so module level helpers
+    # would be NameError on the raspberrypi side
+    from concurrent.futures import ThreadPoolExecutor
     value = list()
-    value.append(socket.gethostname())
-    val = requests.get("http://ip-api.com/json/").json()
+    # the place of the raspberrypi don't change between run, so keep the geo
+    # answers on disk and skip the http call when we already know the answer
+    cache_file = os.path.expanduser("~/.cache/raspberry_control/geocode.json")
+    try:
+        cache = json.load(open(cache_file))
+    except Exception:
+        cache = {"ip": None, "geocode": {}}
+    session = requests.Session()  # keep-alive between the two http calls
+    session.headers["Accept-Encoding"] = "gzip"
+    ip_fresh = cache["ip"] is not None and time.time() - cache["ip"]["time"] < 3600
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        if not ip_fresh:
+            # start the http call right away, the local lookups run during it
+            fetch = ex.submit(session.get, "http://ip-api.com/json/", timeout=5)
+        value.append(socket.gethostname())
+        if ip_fresh:
+            val = cache["ip"]["value"]  # public ip change rarely, 1h TTL
+        else:
+            val = fetch.result().json()
+            cache["ip"] = {"time": time.time(), "value": val}
     latitude = val["lat"]
     longitude = val["lon"]
-    val = requests.get(f"https://geocode.maps.co/reverse?lat={latitude}&lon={longitude}").json()
-    val.pop("licence")
-    val.pop("powered_by")
-    value.append(val["display_name"])
+    key = str(round(latitude, 3)) + "," + str(round(longitude, 3))  # ~110m grid
+    if key not in cache["geocode"]:
+        val = session.get(f"https://geocode.maps.co/reverse?lat={latitude}&lon={longitude}", timeout=5).json()
+        val.pop("licence")
+        val.pop("powered_by")
+        while len(cache["geocode"]) >= 512:  # keep the cache file small
+            cache["geocode"].pop(next(iter(cache["geocode"])))
+        cache["geocode"][key] = val
+    value.append(cache["geocode"][key]["display_name"])
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        json.dump(cache, open(cache_file, "w"))
+    except Exception:
+        pass  # no cache dir, not a problem, just slower next run
     return value
 
 
 if __name__ == "__main__":  # put all you're code to run at start here. Because if not the code will be run 2 time
-    rp.raspberrypi().set_raspberry_info("username here", "password here")
-    rp.raspberrypi().set_preparation("192.168.0.10", 8, 1)  # config locator for the raspberrypi
-    rp.raspberrypi().local("192.168.0.10")  # set the start ip set in the line in the top
+    rp.configure("username here", "password here", "192.168.0.10", 8, 1)  # login info + locator in one call
     rp.config("main")  # file name if this file (no .py)
     print(get_info())
@@ -1 +1 @@
-from .raspberrypi import raspberry_command, timeout, raspberrypi, config, raspberry_command_add,run_command
+from .raspberrypi import raspberry_command, timeout, raspberrypi, config, raspberry_command_add,run_command,flush,run,configure
@@ -1,6 +1,7 @@
 import logging
 import paramiko
 import socket
+import selectors
 from os import path
 import re
 from stat import S_ISDIR, S_ISREG
@@ -8,11 +9,18 @@ import signal
 import psutil
 import time
 import subprocess
+import shutil
 from functools import wraps
-from io import StringIO
+from io import StringIO, BytesIO
 from binascii import hexlify
 import errno
 import os
+import sys
+import queue
+import struct
+import itertools
+import atexit
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 import threading
 import stat
 import threading
@@ -70,6 +78,34 @@ _KEY_TYPES = {
     "ed25519": paramiko.Ed25519Key,
 }
 
+
+def _detect_key_type(first_line):
+    # pick the key classes worth trying from the PEM header so we do one
+    # parse instead of attempting every (expensive) key type in turn
+    if first_line.find("BEGIN OPENSSH PRIVATE KEY") != -1:
+        return [paramiko.Ed25519Key, paramiko.RSAKey, paramiko.ECDSAKey]
+    if first_line.find("BEGIN RSA") != -1:
+        return [paramiko.RSAKey]
+    if first_line.find("BEGIN EC") != -1:
+        return [paramiko.ECDSAKey]
+    if first_line.find("BEGIN DSA") != -1:
+        return [paramiko.DSSKey]
+    return list(_KEY_TYPES.values())
+
+
+def _load_private_key(key_file, key_password):
+    # sniff the header and parse with the matching class only
+    first_line = key_file.readline()
+    key_file.seek(0)
+    last_error = None
+    for key_cls in _detect_key_type(first_line):
+        try:
+            return key_cls.from_private_key(key_file, key_password)
+        except (paramiko.SSHException, ValueError) as e:
+            key_file.seek(0)
+            last_error = e
+    raise last_error
+
 import_list = list()
 imported = "main"
 function_to_add = list()
@@ -93,6 +129,79 @@ class sftp:
 
     b_slash = b"/"
 
+    class _LazyAttr(SFTPAttributes):
+        """
+        `.SFTPAttributes` whose ``longname`` is decoded only when read.
+
+        Directory listings carry a server-formatted ``longname`` for every
+        entry, but most callers never look at it (``listdir`` throws away
+        everything except the filename), so the raw bytes are kept and only
+        decoded on first access.
+        """
+
+        def __getattr__(self, name):
+            if name == "longname":
+                raw = self.__dict__.get("_longname_bytes")
+                if raw is not None:
+                    value = u(raw)
+                    self.longname = value
+                    return value
+            raise AttributeError(name)
+
+    class _RawAttrs:
+        # pre-packed SETSTAT attribute block (uint32 flags + fields), used by
+        # chmod/chown/utime/truncate to skip building a full SFTPAttributes
+        # just to set one field
+        __slots__ = ("data",)
+
+        def __init__(self, data):
+            self.data = data
+
+    class _MsgCursor:
+        # just-enough Message replacement for READDIR parsing: one object
+        # reused across responses, struct.unpack_from straight off the packet
+        # buffer instead of a fresh Message (and its BytesIO) per response
+        __slots__ = ("data", "pos")
+
+        def __init__(self):
+            self.data = b""
+            self.pos = 0
+
+        def reset(self, data):
+            self.data = data
+            self.pos = 0
+
+        def get_int(self):
+            (val,) = struct.unpack_from(">I", self.data, self.pos)
+            self.pos += 4
+            return val
+
+        def get_int64(self):
+            (val,) = struct.unpack_from(">Q", self.data, self.pos)
+            self.pos += 8
+            return val
+
+        def get_string(self):
+            (n,) = struct.unpack_from(">I", self.data, self.pos)
+            start = self.pos + 4
+            self.pos = start + n
+            return self.data[start:self.pos]
+
+        def get_text(self):
+            return u(self.get_string())
+
+    class _pool_borrow:
+        # with-block helper for SFTPPool.client()
+        def __init__(self, pool):
+            self.pool = pool
+
+        def __enter__(self):
+            self.client = self.pool.acquire()
+            return self.client
+
+        def __exit__(self, *exc):
+            self.pool.release(self.client)
+
     class SFTPClient(BaseSFTP, ClosingContextManager):
         """
         SFTP client object.
@@ -103,7 +212,32 @@ class sftp:
         Instances of this class may be used as context managers.
         """
 
-        def __init__(self, sock):
+        # precomputed flag words for the common open() modes ('b'/'U' are
+        # stripped before lookup); same bits the per-character scan produces
+        _MODE_FLAGS = {
+            "r": SFTP_FLAG_READ,
+            "r+": SFTP_FLAG_READ | SFTP_FLAG_WRITE,
+            "w": SFTP_FLAG_WRITE | SFTP_FLAG_CREATE | SFTP_FLAG_TRUNC,
+            "w+": SFTP_FLAG_READ | SFTP_FLAG_WRITE | SFTP_FLAG_CREATE
+            | SFTP_FLAG_TRUNC,
+            "a": SFTP_FLAG_WRITE | SFTP_FLAG_CREATE | SFTP_FLAG_APPEND,
+            "a+": SFTP_FLAG_READ | SFTP_FLAG_WRITE | SFTP_FLAG_CREATE
+            | SFTP_FLAG_APPEND,
+        }
+
+        # exact-type dispatch for the request serializer; the isinstance
+        # chain re-tested every branch for every argument of every request.
+        # handlers are called as handler(msg, item)
+        _MSG_HANDLERS = {
+            int: Message.add_int,
+            bool: Message.add_int,  # bool passed the old isinstance(int)
+            str: Message.add_string,
+            bytes: Message.add_string,
+            int64: Message.add_int64,
+            SFTPAttributes: lambda msg, item: item._pack(msg),
+        }
+
+        def __init__(self, sock, stat_cache_ttl=0):
             """
             Create an SFTP client from an existing `.Channel`.  The channel
             should already have requested the ``"sftp"`` subsystem.
@@ -112,6 +246,12 @@ class sftp:
             `from_transport`.
 
             :param .Channel sock: an open `.Channel` using the ``"sftp"`` subsystem
+            :param float stat_cache_ttl:
+                when non-zero, `stat`/`lstat` results are cached for that many
+                seconds (ENOENT answers for half as long), turning repeated
+                metadata round-trips into dict lookups.  Off by default; the
+                cache is invalidated by the mutating methods of this client
+                but cannot see changes made by other clients.
 
             :raises:
                 `.SSHException` -- if there's an exception while negotiating sftp
@@ -119,12 +259,23 @@ class sftp:
             BaseSFTP.__init__(self)
             self.sock = sock
             self.ultra_debug = False
-            self.request_number = 1
-            # lock for request_number
+            # GIL-atomic request number allocator; much cheaper than taking
+            # a mutex around an increment
+            self._next_request = itertools.count(1).__next__
+            # lock for _expecting
             self._lock = threading.Lock()
             self._cwd = None
+            # cwd + trailing slash, precomputed once per chdir so the
+            # per-call _adjust_cwd is a single concat
+            self._cwd_prefix = None
+            # (cmd, path) -> (timestamp, SFTPAttributes or None for ENOENT)
+            self._stat_ttl = stat_cache_ttl
+            self._stat_cache = {}
             # request # -> SFTPFile
             self._expecting = weakref.WeakValueDictionary()
+            # reverse index, fileobj -> outstanding request #s; keeps
+            # _finish_responses from scanning every pending value per loop
+            self._expected_by_fileobj = weakref.WeakKeyDictionary()
             if type(sock) is Channel:
                 # override default logger
                 transport = self.sock.get_transport()
@@ -142,6 +293,20 @@ class sftp:
                     server_version
                 ),
             )
+            # OpenSSH advertises its real transfer limits through the
+            # limits@openssh.com extension; ask once so transfers can size
+            # their chunks to what the server actually accepts
+            self._limits = None
+            try:
+                t, msg = self._request(CMD_EXTENDED, "limits@openssh.com")
+                self._limits = {
+                    "max_packet_len": msg.get_int64(),
+                    "max_read_len": msg.get_int64(),
+                    "max_write_len": msg.get_int64(),
+                    "max_open_handles": msg.get_int64(),
+                }
+            except Exception:
+                pass  # server without the extension, keep the defaults
 
         @classmethod
         def from_transport(cls, t, window_size=None, max_packet_size=None):
@@ -167,6 +332,10 @@ class sftp:
             .. versionchanged:: 1.15
                 Added the ``window_size`` and ``max_packet_size`` arguments.
             """
+            # default the SSH window/packet size up so paramiko is not the
+            # bottleneck on high bandwidth-delay links
+            window_size = max(window_size or 0, 32 << 20)
+            max_packet_size = max(max_packet_size or 0, 256 << 10)
             chan = t.open_session(
                 window_size=window_size, max_packet_size=max_packet_size
             )
@@ -175,7 +344,44 @@ class sftp:
             chan.invoke_subsystem("sftp")
             return cls(chan)
 
+        @classmethod
+        def from_socket(cls, host, port=22, username=None, password=None,
+                        pkey=None, window_size=None, max_packet_size=None):
+            """
+            Open a tuned TCP connection to ``host`` and return an `.SFTPClient`.
+
+            Unlike `from_transport`, this builds the socket itself so it can
+            set ``TCP_NODELAY`` and grow the kernel send/receive buffers to
+            32 MiB before SSH negotiation; with the system defaults, the
+            kernel ring (not the SSH window) caps SFTP throughput on long fat
+            networks.
+
+            :param str host: the server to connect to
+            :param int port: the server port (defaults to ``22``)
+            :param str username: the user to authenticate as
+            :param str password: password for authentication (or ``None``)
+            :param .PKey pkey: private key for authentication (or ``None``)
+            :param int window_size: optional SSH window size
+            :param int max_packet_size: optional max packet size
+
+            :return: a new `.SFTPClient` over the tuned connection
+            """
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 32 << 20)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 32 << 20)
+            sock.connect((host, port))
+            t = paramiko.Transport(sock)
+            t.connect(username=username, password=password, pkey=pkey)
+            return cls.from_transport(
+                t, window_size=window_size, max_packet_size=max_packet_size
+            )
+
         def _log(self, level, msg, *args):
+            if not self.logger.isEnabledFor(level):
+                # skip the replace()/format work below when nobody listens,
+                # _log sits on the hot path of every request
+                return
             if isinstance(msg, list):
                 for m in msg:
                     self._log(level, m, *args)
@@ -209,6 +415,45 @@ class sftp:
             """
             return self.sock
 
+        def _parse_name_batch(self, msg, count, filelist):
+            # tight inner loop for CMD_NAME responses: message accessors and
+            # flag constants are bound as locals once and the attribute block
+            # is read inline, instead of paying method dispatch plus a full
+            # _from_msg/_unpack per entry.  '.' and '..' are dropped here.
+            get_text = msg.get_text
+            get_string = msg.get_string
+            get_int = msg.get_int
+            get_int64 = msg.get_int64
+            LazyAttr = sftp._LazyAttr
+            append = filelist.append
+            FLAG_SIZE = SFTPAttributes.FLAG_SIZE
+            FLAG_UIDGID = SFTPAttributes.FLAG_UIDGID
+            FLAG_PERMISSIONS = SFTPAttributes.FLAG_PERMISSIONS
+            FLAG_AMTIME = SFTPAttributes.FLAG_AMTIME
+            FLAG_EXTENDED = SFTPAttributes.FLAG_EXTENDED
+            for i in range(count):
+                filename = get_text()
+                longname_bytes = get_string()
+                attr = LazyAttr()
+                attr._flags = flags = get_int()
+                if flags & FLAG_SIZE:
+                    attr.st_size = get_int64()
+                if flags & FLAG_UIDGID:
+                    attr.st_uid = get_int()
+                    attr.st_gid = get_int()
+                if flags & FLAG_PERMISSIONS:
+                    attr.st_mode = get_int()
+                if flags & FLAG_AMTIME:
+                    attr.st_atime = get_int()
+                    attr.st_mtime = get_int()
+                if flags & FLAG_EXTENDED:
+                    for j in range(get_int()):
+                        attr.attr[get_string()] = get_string()
+                attr.filename = filename
+                attr._longname_bytes = longname_bytes
+                if (filename != ".") and (filename != ".."):
+                    append(attr)
+
         def listdir(self, path="."):
             """
             Return a list containing the names of the entries in the given
@@ -223,7 +468,7 @@ class sftp:
             """
             return [f.filename for f in self.listdir_attr(path)]
 
-        def listdir_attr(self, path="."):
+        def listdir_attr(self, path=".", read_aheads=50):
             """
             Return a list containing `.SFTPAttributes` objects corresponding to
             files in the given ``path``.  The list is in arbitrary order.  It does
@@ -235,7 +480,12 @@ class sftp:
             attributes, in unix format.  The content of this string will probably
             depend on the SFTP server implementation.
 
+            Like `listdir_iter`, up to ``read_aheads`` ``SSH_FXP_READDIR``
+            requests are kept in flight at once, so on slow links the listing
+            cost is one round-trip per window instead of one per request.
+
             :param str path: path to list (defaults to ``'.'``)
+            :param int read_aheads: number of READDIR requests kept in flight
             :return: list of `.SFTPAttributes` objects
 
             .. versionadded:: 1.2
@@ -247,22 +497,34 @@ class sftp:
                 raise SFTPError("Expected handle")
             handle = msg.get_binary()
             filelist = []
-            while True:
-                try:
-                    t, msg = self._request(CMD_READDIR, handle)
-                except EOFError:
-                    # done with handle
-                    break
-                if t != CMD_NAME:
-                    raise SFTPError("Expected name response")
-                count = msg.get_int()
-                for i in range(count):
-                    filename = msg.get_text()
-                    longname = msg.get_text()
-                    attr = SFTPAttributes._from_msg(msg, filename, longname)
-                    if (filename != ".") and (filename != ".."):
-                        filelist.append(attr)
-            self._request(CMD_CLOSE, handle)
+            nums = list()
+            eof = False
+            cur = sftp._MsgCursor()
+            try:
+                while True:
+                    while not eof and len(nums) < read_aheads:
+                        nums.append(self._async_request(
+                            type(None), CMD_READDIR, handle))
+                    if not nums:
+                        break
+                    num = nums.pop(0)
+                    t, pkt_data = self._read_packet()
+                    cur.reset(pkt_data)
+                    new_num = cur.get_int()
+                    self._forget_request(new_num)
+                    if t == CMD_STATUS:
+                        if num == new_num:
+                            try:
+                                self._convert_status(cur)
+                            except EOFError:
+                                # stop refilling, just drain what is in flight
+                                eof = True
+                        continue
+                    if t != CMD_NAME:
+                        raise SFTPError("Expected name response")
+                    self._parse_name_batch(cur, cur.get_int(), filelist)
+            finally:
+                self._request(CMD_CLOSE, handle)
             return filelist
 
         def listdir_iter(self, path=".", read_aheads=50):
@@ -289,6 +551,7 @@ class sftp:
             handle = msg.get_string()
 
             nums = list()
+            cur = sftp._MsgCursor()
             while True:
                 try:
                     # Send out a bunch of readdir requests so that we can read the
@@ -306,28 +569,35 @@ class sftp:
                     # some more requests
                     # Exit the loop when we've reached the end of the directory
                     # handle
-                    for num in nums:
+                    while nums:
+                        num = nums.pop(0)
                         t, pkt_data = self._read_packet()
-                        msg = Message(pkt_data)
-                        new_num = msg.get_int()
+                        cur.reset(pkt_data)
+                        new_num = cur.get_int()
+                        self._forget_request(new_num)
                         if num == new_num:
                             if t == CMD_STATUS:
-                                self._convert_status(msg)
-                        count = msg.get_int()
-                        for i in range(count):
-                            filename = msg.get_text()
-                            longname = msg.get_text()
-                            attr = SFTPAttributes._from_msg(
-                                msg, filename, longname
-                            )
-                            if (filename != ".") and (filename != ".."):
-                                yield attr
-
-                    # If we've hit the end of our queued requests, reset nums.
-                    nums = list()
+                                self._convert_status(cur)
+                        batch = []
+                        self._parse_name_batch(cur, cur.get_int(), batch)
+                        for attr in batch:
+                            yield attr
 
                 except EOFError:
-                    self._request(CMD_CLOSE, handle)
+                    # Send the close right away instead of draining the
+                    # in-flight READDIRs first; the server stops reading the
+                    # directory one window earlier. Everything still in nums
+                    # is just an EOF status now, read those off the socket
+                    # and throw them away without parsing.
+                    self._async_request(type(None), CMD_CLOSE, handle)
+                    while nums:
+                        nums.pop(0)
+                        t, pkt_data = self._read_packet()
+                        cur.reset(pkt_data)
+                        self._forget_request(cur.get_int())
+                    t, pkt_data = self._read_packet()  # the CMD_CLOSE status
+                    cur.reset(pkt_data)
+                    self._forget_request(cur.get_int())
                     return
 
         def open(self, filename, mode="r", bufsize=-1):
@@ -364,17 +634,23 @@ class sftp:
             """
             filename = self._adjust_cwd(filename)
             self._log(DEBUG, "open({!r}, {!r})".format(filename, mode))
-            imode = 0
-            if ("r" in mode) or ("+" in mode):
-                imode |= SFTP_FLAG_READ
-            if ("w" in mode) or ("+" in mode) or ("a" in mode):
-                imode |= SFTP_FLAG_WRITE
-            if "w" in mode:
-                imode |= SFTP_FLAG_CREATE | SFTP_FLAG_TRUNC
-            if "a" in mode:
-                imode |= SFTP_FLAG_CREATE | SFTP_FLAG_APPEND
-            if "x" in mode:
-                imode |= SFTP_FLAG_CREATE | SFTP_FLAG_EXCL
+            # common modes resolve with one dict lookup; anything unusual
+            # falls back to the flag-by-flag scan below
+            imode = self._MODE_FLAGS.get(mode.replace("b", "").replace("U", ""))
+            if imode is None:
+                imode = 0
+                if ("r" in mode) or ("+" in mode):
+                    imode |= SFTP_FLAG_READ
+                if ("w" in mode) or ("+" in mode) or ("a" in mode):
+                    imode |= SFTP_FLAG_WRITE
+                if "w" in mode:
+                    imode |= SFTP_FLAG_CREATE | SFTP_FLAG_TRUNC
+                if "a" in mode:
+                    imode |= SFTP_FLAG_CREATE | SFTP_FLAG_APPEND
+                if "x" in mode:
+                    imode |= SFTP_FLAG_CREATE | SFTP_FLAG_EXCL
+            if imode & SFTP_FLAG_WRITE:
+                self._stat_invalidate(filename)
             attrblock = SFTPAttributes()
             t, msg = self._request(CMD_OPEN, filename, imode, attrblock)
             if t != CMD_HANDLE:
@@ -402,6 +678,7 @@ class sftp:
             """
             path = self._adjust_cwd(path)
             self._log(DEBUG, "remove({!r})".format(path))
+            self._stat_invalidate(path)
             self._request(CMD_REMOVE, path)
 
         unlink = remove
@@ -427,6 +704,7 @@ class sftp:
             oldpath = self._adjust_cwd(oldpath)
             newpath = self._adjust_cwd(newpath)
             self._log(DEBUG, "rename({!r}, {!r})".format(oldpath, newpath))
+            self._stat_invalidate(oldpath, newpath)
             self._request(CMD_RENAME, oldpath, newpath)
 
         def posix_rename(self, oldpath, newpath):
@@ -448,10 +726,26 @@ class sftp:
             newpath = self._adjust_cwd(newpath)
             self._log(DEBUG, "posix_rename({!r}, {!r})".format(
                 oldpath, newpath))
+            self._stat_invalidate(oldpath, newpath)
             self._request(
                 CMD_EXTENDED, "posix-rename@openssh.com", oldpath, newpath
             )
 
+        def fsync(self, handle):
+            """
+            Ask the server to flush an open file to disk
+            (``fsync@openssh.com`` extension, OpenSSH 6.3+).
+
+            :param handle:
+                an open `.SFTPFile`, or the raw server-side handle bytes
+
+            :raises:
+                ``IOError`` -- if the server does not support the extension
+            """
+            handle = getattr(handle, "handle", handle)
+            self._log(DEBUG, "fsync({!r})".format(handle))
+            self._request(CMD_EXTENDED, "fsync@openssh.com", handle)
+
         def mkdir(self, path, mode=o777):
             """
             Create a folder (directory) named ``path`` with numeric mode ``mode``.
@@ -463,6 +757,7 @@ class sftp:
             """
             path = self._adjust_cwd(path)
             self._log(DEBUG, "mkdir({!r}, {!r})".format(path, mode))
+            self._stat_invalidate(path)
             attr = SFTPAttributes()
             attr.st_mode = mode
             self._request(CMD_MKDIR, path, attr)
@@ -475,6 +770,7 @@ class sftp:
             """
             path = self._adjust_cwd(path)
             self._log(DEBUG, "rmdir({!r})".format(path))
+            self._stat_invalidate(path)
             self._request(CMD_RMDIR, path)
 
         def stat(self, path):
@@ -498,10 +794,7 @@ class sftp:
             """
             path = self._adjust_cwd(path)
             self._log(DEBUG, "stat({!r})".format(path))
-            t, msg = self._request(CMD_STAT, path)
-            if t != CMD_ATTRS:
-                raise SFTPError("Expected attributes")
-            return SFTPAttributes._from_msg(msg)
+            return self._cached_stat(CMD_STAT, path)
 
         def lstat(self, path):
             """
@@ -516,10 +809,43 @@ class sftp:
             """
             path = self._adjust_cwd(path)
             self._log(DEBUG, "lstat({!r})".format(path))
-            t, msg = self._request(CMD_LSTAT, path)
+            return self._cached_stat(CMD_LSTAT, path)
+
+        def _cached_stat(self, cmd, path):
+            # shared stat/lstat path with the optional TTL cache; path is
+            # already adjusted for the emulated cwd
+            if self._stat_ttl:
+                hit = self._stat_cache.get((cmd, path))
+                if hit is not None:
+                    stamp, attr = hit
+                    # failed lookups stay cached half as long
+                    ttl = self._stat_ttl if attr is not None else self._stat_ttl / 2
+                    if time.time() - stamp < ttl:
+                        if attr is None:
+                            raise IOError(errno.ENOENT, "No such file")
+                        return attr
+                    del self._stat_cache[(cmd, path)]
+            try:
+                t, msg = self._request(cmd, path)
+            except IOError as e:
+                if self._stat_ttl and e.errno == errno.ENOENT:
+                    self._stat_cache[(cmd, path)] = (time.time(), None)
+                raise
             if t != CMD_ATTRS:
                 raise SFTPError("Expected attributes")
-            return SFTPAttributes._from_msg(msg)
+            attr = SFTPAttributes._from_msg(msg)
+            if self._stat_ttl:
+                if len(self._stat_cache) > 1024:
+                    self._stat_cache.clear()
+                self._stat_cache[(cmd, path)] = (time.time(), attr)
+            return attr
+
+        def _stat_invalidate(self, *paths):
+            # forget cached answers for paths we just changed
+            if self._stat_ttl:
+                for path in paths:
+                    self._stat_cache.pop((CMD_STAT, path), None)
+                    self._stat_cache.pop((CMD_LSTAT, path), None)
 
         def symlink(self, source, dest):
             """
@@ -531,6 +857,7 @@ class sftp:
             dest = self._adjust_cwd(dest)
             self._log(DEBUG, "symlink({!r}, {!r})".format(source, dest))
             source = b(source)
+            self._stat_invalidate(dest)
             self._request(CMD_SYMLINK, source, dest)
 
         def chmod(self, path, mode):
@@ -544,8 +871,9 @@ class sftp:
             """
             path = self._adjust_cwd(path)
             self._log(DEBUG, "chmod({!r}, {!r})".format(path, mode))
-            attr = SFTPAttributes()
-            attr.st_mode = mode
+            self._stat_invalidate(path)
+            attr = sftp._RawAttrs(
+                struct.pack(">II", SFTPAttributes.FLAG_PERMISSIONS, mode))
             self._request(CMD_SETSTAT, path, attr)
 
         def chown(self, path, uid, gid):
@@ -561,8 +889,9 @@ class sftp:
             """
             path = self._adjust_cwd(path)
             self._log(DEBUG, "chown({!r}, {!r}, {!r})".format(path, uid, gid))
-            attr = SFTPAttributes()
-            attr.st_uid, attr.st_gid = uid, gid
+            self._stat_invalidate(path)
+            attr = sftp._RawAttrs(
+                struct.pack(">III", SFTPAttributes.FLAG_UIDGID, uid, gid))
             self._request(CMD_SETSTAT, path, attr)
 
         def utime(self, path, times):
@@ -583,8 +912,14 @@ class sftp:
             if times is None:
                 times = (time.time(), time.time())
             self._log(DEBUG, "utime({!r}, {!r})".format(path, times))
-            attr = SFTPAttributes()
-            attr.st_atime, attr.st_mtime = times
+            self._stat_invalidate(path)
+            attr = sftp._RawAttrs(
+                struct.pack(
+                    ">III",
+                    SFTPAttributes.FLAG_AMTIME,
+                    int(times[0]),
+                    int(times[1]),
+                ))
             self._request(CMD_SETSTAT, path, attr)
 
         def truncate(self, path, size):
@@ -598,8 +933,9 @@ class sftp:
             """
             path = self._adjust_cwd(path)
             self._log(DEBUG, "truncate({!r}, {!r})".format(path, size))
-            attr = SFTPAttributes()
-            attr.st_size = size
+            self._stat_invalidate(path)
+            attr = sftp._RawAttrs(
+                struct.pack(">IQ", SFTPAttributes.FLAG_SIZE, size))
             self._request(CMD_SETSTAT, path, attr)
 
         def readlink(self, path):
@@ -663,11 +999,34 @@ class sftp:
             """
             if path is None:
                 self._cwd = None
+                self._cwd_prefix = None
                 return
-            if not stat.S_ISDIR(self.stat(path).st_mode):
+            # one CMD_REALPATH both resolves the path and, on servers that
+            # send attributes along with the name, already tells us whether
+            # it is a directory; the extra stat() round-trip is only the
+            # fallback for servers that return empty attributes
+            adjusted = self._adjust_cwd(path)
+            self._log(DEBUG, "normalize({!r})".format(adjusted))
+            t, msg = self._request(CMD_REALPATH, adjusted)
+            if t != CMD_NAME:
+                raise SFTPError("Expected name response")
+            count = msg.get_int()
+            if count != 1:
+                raise SFTPError("Realpath returned {} results".format(count))
+            normalized = msg.get_text()
+            msg.get_text()  # longname, unused
+            attr = SFTPAttributes._from_msg(msg)
+            st_mode = getattr(attr, "st_mode", None)
+            if st_mode is None:
+                st_mode = self.stat(normalized).st_mode
+            if not stat.S_ISDIR(st_mode):
                 code = errno.ENOTDIR
                 raise SFTPError(code, "{}: {}".format(os.strerror(code), path))
-            self._cwd = b(self.normalize(path))
+            self._cwd = b(normalized)
+            if self._cwd == b"/":
+                self._cwd_prefix = self._cwd
+            else:
+                self._cwd_prefix = self._cwd + b"/"
 
         def getcwd(self):
             """
@@ -680,19 +1039,39 @@ class sftp:
             # TODO: make class initialize with self._cwd set to self.normalize('.')
             return self._cwd and u(self._cwd)
 
-        def _transfer_with_callback(self, reader, writer, file_size, callback):
+        def _transfer_with_callback(self, reader, writer, file_size, callback,
+                                    chunk_size=32768):
+            # fixed-size chunks keep the pipelined request window busy; an
+            # unbounded read() would drain the source in one gulp and defeat
+            # the write pipelining entirely.  When the source supports
+            # readinto we reuse a single buffer instead of allocating (and
+            # copying) a fresh bytes object per chunk
             size = 0
-            while True:
-                data = reader.read()
-                writer.write(str(data))
-                size += len(data)
-                if len(data) == 0:
-                    break
-                if callback is not None:
-                    callback(size, file_size)
-            return str(size)
-
-        def putfo(self, fl, remotepath, file_size=0, callback=None, confirm=True):
+            readinto = getattr(reader, "readinto", None)
+            if readinto is not None:
+                buf = bytearray(chunk_size)
+                view = memoryview(buf)
+                while True:
+                    n = readinto(buf)
+                    if not n:
+                        break
+                    writer.write(view[:n])
+                    size += n
+                    if callback is not None:
+                        callback(size, file_size)
+            else:
+                while True:
+                    data = reader.read(chunk_size)
+                    if len(data) == 0:
+                        break
+                    writer.write(data)
+                    size += len(data)
+                    if callback is not None:
+                        callback(size, file_size)
+            return size
+
+        def putfo(self, fl, remotepath, file_size=0, callback=None, confirm=True,
+                  chunk_size=None):
             """
             Copy the contents of an open file object (``fl``) to the SFTP server as
             ``remotepath``. Any exception raised by operations will be passed
@@ -712,6 +1091,11 @@ class sftp:
             :param bool confirm:
                 whether to do a stat() on the file afterwards to confirm the file
                 size (since 1.7.7)
+            :param int chunk_size:
+                size of the blocks read from ``fl`` and kept in flight;
+                defaults to the server's advertised ``max_write_len`` when it
+                supports ``limits@openssh.com``, else 32768 (the OpenSSH
+                ``-B`` default)
 
             :return:
                 an `.SFTPAttributes` object containing attributes about the given
@@ -719,13 +1103,31 @@ class sftp:
 
             .. versionadded:: 1.10
             """
+            if chunk_size is None:
+                chunk_size = 32768
+                if self._limits is not None:
+                    # cap it, some servers advertise silly-big writes
+                    chunk_size = min(
+                        self._limits["max_write_len"], 1 << 20) or 32768
+            s = None
             with self.file(remotepath, "wb") as fr:
                 fr.set_pipelined(True)
                 size = self._transfer_with_callback(
-                    reader=fl, writer=fr, file_size=file_size, callback=callback
+                    reader=fl, writer=fr, file_size=file_size,
+                    callback=callback, chunk_size=chunk_size
                 )
+                if confirm:
+                    # CMD_FSTAT on the still-open handle saves the separate
+                    # CMD_STAT round-trip after close; the server processes
+                    # it after the writes already on the wire
+                    fr.flush()
+                    try:
+                        s = fr.stat()
+                    except IOError:
+                        s = None  # server without fstat, stat after close
             if confirm:
-                s = self.stat(remotepath)
+                if s is None:
+                    s = self.stat(remotepath)
                 if s.st_size != size:
                     raise IOError(
                         "size mismatch in put!  {} != {}".format(
@@ -763,8 +1165,14 @@ class sftp:
             .. versionchanged:: 1.7.7
                 ``confirm`` param added.
             """
-            file_size = os.stat(localpath).st_size
-            with open(localpath, "rb") as fl:
+            # open once and fstat the fd instead of a separate stat(); an
+            # unbuffered file object lets the chunked reader pull straight
+            # from the kernel with no double copy through Python's buffer
+            # O_BINARY keeps Windows from CRLF-translating the fd; it does
+            # not exist on posix, hence the getattr (same trick as tempfile)
+            fd = os.open(localpath, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+            file_size = os.fstat(fd).st_size
+            with os.fdopen(fd, "rb", buffering=0) as fl:
                 return self.putfo(fl, remotepath, file_size, callback, confirm)
 
         def getfo(self, remotepath, fl, callback=None, prefetch=True):
@@ -790,8 +1198,22 @@ class sftp:
             """
             file_size = self.stat(remotepath).st_size
             with self.open(remotepath, "rb") as fr:
+                if file_size <= 128 * 1024:
+                    # fits in a handful of reads; spinning up the prefetch
+                    # thread costs more than it saves here
+                    data = fr.read(file_size)
+                    fl.write(data)
+                    if callback is not None:
+                        callback(len(data), file_size)
+                    return len(data)
                 if prefetch:
                     fr.prefetch(file_size)
+                if callback is None:
+                    # nobody watching the progress, let shutil run the
+                    # read/write loop in C with 1 MiB chunks
+                    start = fl.tell() if fl.seekable() else 0
+                    shutil.copyfileobj(fr, fl, length=1 << 20)
+                    return (fl.tell() - start) if fl.seekable() else file_size
                 return self._transfer_with_callback(
                     reader=fr, writer=fl, file_size=file_size, callback=callback
                 )
@@ -818,10 +1240,12 @@ class sftp:
             """
             with open(localpath, "wb") as fl:
                 size = self.getfo(remotepath, fl, callback, prefetch)
-            s = os.stat(localpath)
-            if s.st_size != size:
+                # the file position after writing is the on-disk size, no
+                # need to stat the path again after close
+                written = fl.tell()
+            if written != size:
                 raise IOError(
-                    "size mismatch in get!  {} != {}".format(s.st_size, size)
+                    "size mismatch in get!  {} != {}".format(written, size)
                 )
 
         # ...internals...
@@ -832,41 +1256,53 @@ class sftp:
 
         def _async_request(self, fileobj, t, *args):
             # this method may be called from other threads (prefetch)
+            num = self._next_request()
+            # serialize outside the lock, nothing here touches shared state;
+            # concurrent prefetch threads only contend for the two dict writes
+            msg = Message()
+            msg.add_int(num)
+            handlers = self._MSG_HANDLERS
+            for item in args:
+                handler = handlers.get(type(item))
+                if handler is not None:
+                    handler(msg, item)
+                elif isinstance(item, sftp._RawAttrs):
+                    # already wire-format, append as-is (no length prefix)
+                    msg.add_bytes(item.data)
+                elif isinstance(item, SFTPAttributes):
+                    item._pack(msg)  # subclasses miss the exact-type hit
+                else:
+                    # For all other types, rely on as_string() to either coerce
+                    # to bytes before writing or raise a suitable exception.
+                    msg.add_string(item)
             self._lock.acquire()
             try:
-                msg = Message()
-                msg.add_int(self.request_number)
-                for item in args:
-                    if isinstance(item, int64):
-                        msg.add_int64(item)
-                    elif isinstance(item, int):
-                        msg.add_int(item)
-                    elif isinstance(item, SFTPAttributes):
-                        item._pack(msg)
-                    else:
-                        # For all other types, rely on as_string() to either coerce
-                        # to bytes before writing or raise a suitable exception.
-                        msg.add_string(item)
-                num = self.request_number
                 self._expecting[num] = fileobj
-                self.request_number += 1
+                self._expected_by_fileobj.setdefault(fileobj, set()).add(num)
             finally:
                 self._lock.release()
             self._send_packet(t, msg)
             return num
 
         def _read_response(self, waitfor=None):
+            # hot loop during prefetch: every name used per iteration is
+            # bound as a local up front instead of re-resolved through self
+            read_packet = self._read_packet
+            expecting = self._expecting
+            acquire = self._lock.acquire
+            release = self._lock.release
+            message = Message
             while True:
                 try:
-                    t, data = self._read_packet()
+                    t, data = read_packet()
                 except EOFError as e:
                     raise SSHException(
                         "Server connection dropped: {}".format(e))
-                msg = Message(data)
+                msg = message(data)
                 num = msg.get_int()
-                self._lock.acquire()
+                acquire()
                 try:
-                    if num not in self._expecting:
+                    if num not in expecting:
                         # might be response for a file that was closed before
                         # responses came back
                         self._log(DEBUG, "Unexpected response #{}".format(num))
@@ -874,10 +1310,15 @@ class sftp:
                             # just doing a single check
                             break
                         continue
-                    fileobj = self._expecting[num]
-                    del self._expecting[num]
+                    fileobj = expecting[num]
+                    del expecting[num]
+                    nums = self._expected_by_fileobj.get(fileobj)
+                    if nums is not None:
+                        nums.discard(num)
+                        if not nums:
+                            del self._expected_by_fileobj[fileobj]
                 finally:
-                    self._lock.release()
+                    release()
                 if num == waitfor:
                     # synchronous
                     if t == CMD_STATUS:
@@ -893,8 +1334,25 @@ class sftp:
                     break
             return None, None
 
+        def _forget_request(self, num):
+            # drop a request consumed outside _read_response from both maps;
+            # type(None) entries are immortal, the weak dicts never collect
+            # them on their own
+            self._lock.acquire()
+            try:
+                fileobj = self._expecting.pop(num, None)
+                if fileobj is None:
+                    return
+                nums = self._expected_by_fileobj.get(fileobj)
+                if nums is not None:
+                    nums.discard(num)
+                    if not nums:
+                        del self._expected_by_fileobj[fileobj]
+            finally:
+                self._lock.release()
+
         def _finish_responses(self, fileobj):
-            while fileobj in self._expecting.values():
+            while self._expected_by_fileobj.get(fileobj):
                 self._read_response()
                 fileobj._check_exception()
 
@@ -916,20 +1374,16 @@ class sftp:
             else:
                 raise IOError(text)
 
-        def _adjust_cwd(self, path):
+        def _adjust_cwd(self, path, b_slash=b"/", b=b):
             """
             Return an adjusted path if we're emulating a "current working
-            directory" for the server.
+            directory" for the server.  The joined prefix is precomputed by
+            `chdir`, so the hot path is one startswith check and one concat.
             """
             path = b(path)
-            if self._cwd is None:
+            if self._cwd_prefix is None or path[:1] == b_slash:
                 return path
-            if len(path) and path[0:1] == b_slash:
-                # absolute path
-                return path
-            if self._cwd == b_slash:
-                return self._cwd + path
-            return self._cwd + b_slash + path
+            return self._cwd_prefix + path
 
     class SFTP(SFTPClient):
         """
@@ -938,8 +1392,187 @@ class sftp:
 
         pass
 
+    class SFTPPool:
+        """
+        A pool of independent `.SFTPClient` connections to the same server.
+
+        paramiko channels are not thread safe, so parallel transfers must not
+        share one client; every request on a single channel also serializes
+        on its request-number lock.  The pool keeps up to ``size``
+        authenticated clients and hands them out one per operation::
+
+            pool = sftp.SFTPPool(lambda: sftp.SFTPClient.from_socket(...), size=8)
+            with pool.client() as c:
+                c.put(local, remote)
+
+        :param callable factory:
+            zero-argument callable returning a connected `.SFTPClient`
+        :param int size: maximum number of clients kept open
+        """
+
+        def __init__(self, factory, size=8):
+            self.factory = factory
+            self.size = size
+            self._idle = queue.LifoQueue()
+            self._created = 0
+            self._lock = threading.Lock()
+
+        def acquire(self):
+            """
+            Borrow a client, creating one if the pool is not full yet.  Blocks
+            while ``size`` clients are already borrowed.  Idle clients are
+            validated with a cheap ``REALPATH .`` probe and recycled if the
+            connection died while pooled.
+            """
+            while True:
+                try:
+                    client = self._idle.get_nowait()
+                except queue.Empty:
+                    with self._lock:
+                        make_new = self._created < self.size
+                        if make_new:
+                            self._created += 1
+                    if make_new:
+                        try:
+                            return self.factory()
+                        except Exception:
+                            with self._lock:
+                                self._created -= 1
+                            raise
+                    client = self._idle.get()
+                try:
+                    client.normalize(".")
+                    return client
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    try:
+                        client.close()
+                    except Exception:
+                        pass
+
+        def release(self, client):
+            """
+            Return a borrowed client to the pool.
+            """
+            self._idle.put(client)
+
+        def client(self):
+            """
+            Context manager wrapping `acquire`/`release` for a ``with`` block.
+            """
+            return sftp._pool_borrow(self)
+
+        def close(self):
+            """
+            Close every idle client.  Borrowed clients are closed when they
+            fail their next validation probe.
+            """
+            while True:
+                try:
+                    client = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                with self._lock:
+                    self._created -= 1
+                try:
+                    client.close()
+                except Exception:
+                    pass
+
+    def put_dir_concurrent(pool, localpath, remotepath, concurrency=8,
+                           confirm=False):
+        """
+        Upload a whole local directory tree over several SFTP connections.
+
+        The local tree is walked once, the remote folders are created first,
+        then the file uploads are spread across ``concurrency`` workers, each
+        borrowing its own client from ``pool`` (clients are never shared
+        between threads).  For a directory of many small files this is
+        roughly ``concurrency`` times faster than a serial loop, since the
+        per-file round-trips overlap.
+
+        :param .SFTPPool pool: pool of clients to borrow from
+        :param str localpath: local directory to upload
+        :param str remotepath: remote directory to create and fill
+        :param int concurrency: number of parallel transfers
+        :param bool confirm:
+            whether to stat() each file after upload; off by default since
+            the extra round-trip doubles the cost of tiny files
+        """
+        jobs = list()
+        dirs = [remotepath]
+        for root, subdirs, files in os.walk(localpath):
+            rel = os.path.relpath(root, localpath)
+            if rel == ".":
+                rroot = remotepath
+            else:
+                rroot = remotepath + "/" + rel.replace(os.sep, "/")
+                dirs.append(rroot)
+            for name in files:
+                jobs.append((os.path.join(root, name), rroot + "/" + name))
+        with pool.client() as c:
+            for d in dirs:
+                try:
+                    c.mkdir(d)
+                except IOError:
+                    pass  # folder already there
+
+        def worker(job):
+            with pool.client() as c:
+                c.put(job[0], job[1], confirm=confirm)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as ex:
+            for fut in [ex.submit(worker, job) for job in jobs]:
+                fut.result()
+
+    def get_dir_concurrent(pool, remotepath, localpath, concurrency=8):
+        """
+        Download a whole remote directory tree over several SFTP connections.
+
+        Counterpart of `put_dir_concurrent`: the remote tree is listed first
+        (one `~SFTPClient.listdir_attr` per folder), then the file downloads
+        run on ``concurrency`` workers with one pooled client each.
+
+        :param .SFTPPool pool: pool of clients to borrow from
+        :param str remotepath: remote directory to download
+        :param str localpath: local directory to create and fill
+        :param int concurrency: number of parallel transfers
+        """
+        jobs = list()
+        dirs = [(remotepath, localpath)]
+        gh = 0
+        while gh < len(dirs):
+            rdir, ldir = dirs[gh]
+            gh = gh + 1
+            os.makedirs(ldir, exist_ok=True)
+            with pool.client() as c:
+                entries = c.listdir_attr(rdir)
+            for a in entries:
+                if S_ISDIR(a.st_mode):
+                    dirs.append(
+                        (rdir + "/" + a.filename, os.path.join(ldir, a.filename)))
+                elif S_ISREG(a.st_mode):
+                    jobs.append(
+                        (rdir + "/" + a.filename, os.path.join(ldir, a.filename)))
+
+        def worker(job):
+            with pool.client() as c:
+                c.get(job[0], job[1])
+
+        with ThreadPoolExecutor(max_workers=concurrency) as ex:
+            for fut in [ex.submit(worker, job) for job in jobs]:
+                fut.result()
+
 
 class ssh:
+
+    # file kind by (st_mode >> 12) & 0xF: one shift + bytearray index per
+    # entry instead of an S_ISDIR/S_ISREG call each ('d'ir, 'f'ile, 'o'ther)
+    _KIND = bytearray(b"o" * 16)
+    _KIND[0o04] = ord("d")
+    _KIND[0o10] = ord("f")
+
     class SFTPController(sftp.SFTPClient):
         def __init__(self, sock):
             super().__init__(sock)
@@ -951,15 +1584,26 @@ class ssh:
                 return e.errno != errno.ENOENT
             return True
 
+        def list_entries(self, path):
+            # one listdir_attr for both kinds; callers wanting dirs and files
+            # used to pay for two full directory listings
+            dirs, files = [], []
+            kind = ssh._KIND  # locals, the loop can be long
+            is_dir, is_file = ord("d"), ord("f")
+            dirs_append, files_append = dirs.append, files.append
+            for d in self.listdir_attr(path):
+                k = kind[(d.st_mode >> 12) & 0xF]
+                if k == is_dir:
+                    dirs_append(d.filename)
+                elif k == is_file:
+                    files_append(d.filename)
+            return dirs, files
+
         def list_dirs(self, path):
-            return [
-                d.filename for d in self.listdir_attr(path) if S_ISDIR(d.st_mode)
-            ]
+            return self.list_entries(path)[0]
 
         def list_files(self, path):
-            return [
-                f.filename for f in self.listdir_attr(path) if S_ISREG(f.st_mode)
-            ]
+            return self.list_entries(path)[1]
 
         @classmethod
         def from_transport(cls, t):
@@ -977,28 +1621,34 @@ class ssh:
                 key_type="rsa",
                 ssh_password=None,
                 port=22,
+                timeout=None,
         ):
             self.host = host
             self.user = user
             self.ssh_password = ssh_password if not key_path else None
             self.port = port
-            self.nb_bytes = 1024
+            # enforced by the kernel / paramiko, not by SIGALRM, so a
+            # controller with a timeout is safe to use from worker threads
+            self.timeout = timeout
+            # big recv chunks: this path is syscall + python overhead bound,
+            # not network bound, so pulling 256 KiB at a time beats 1 KiB
+            self.nb_bytes = 256 * 1024
             self.keys = []
             self.transport = None
+            self._sftp = None  # lazily opened by __getattr__
+            self._sftp_lock = threading.Lock()
             key_type = key_type.lower()
 
             if key_path:
                 key_file = open(path.expanduser(key_path), 'r')
-                key = _KEY_TYPES[key_type].from_private_key(
-                    key_file, key_password)
+                key = _load_private_key(key_file, key_password)
                 self.keys.append(key)
             elif ssh_password is None:
                 self.keys = paramiko.Agent().get_keys()
                 try:
                     key_file = open(path.expanduser(
                         f"~/.ssh/id_{key_type}"), 'r')
-                    key = _KEY_TYPES[key_type].from_private_key(
-                        key_file, key_password)
+                    key = _load_private_key(key_file, key_password)
                 except Exception:
                     pass
                 else:
@@ -1009,11 +1659,20 @@ class ssh:
 
         def connect(self):
             try:
-                ssh_socket = socket.create_connection((self.host, self.port))
+                ssh_socket = socket.create_connection(
+                    (self.host, self.port), timeout=self.timeout)
             except OSError as e:
                 return 1
 
             self.transport = paramiko.Transport(ssh_socket)
+            # every channel opened on this transport (exec and sftp alike)
+            # inherits these; the stock 2 MiB window stalls bulk transfers
+            # on fat links long before the wire is full
+            self.transport.default_window_size = 16 * 1024 * 1024
+            self.transport.default_max_packet_size = 256 * 1024
+            if self.timeout is not None:
+                self.transport.banner_timeout = self.timeout
+                self.transport.auth_timeout = self.timeout
 
             if self.ssh_password is not None:
                 try:
@@ -1044,7 +1703,7 @@ class ssh:
         ):
             exit_code, output = 0, ""
             channel = self.transport.open_session()
-            channel.settimeout(2)
+            channel.settimeout(0)
             channel.set_combine_stderr(combine_stderr)
             if shell:
                 channel.get_pty()
@@ -1053,22 +1712,28 @@ class ssh:
             if not display and not capture:
                 stop_event.wait()
             else:
-                while True:
-                    try:
-                        raw_data = channel.recv(self.nb_bytes)
-                    except socket.timeout:
-                        if stop_event.is_set():
+                # sleep in select() on the channel fd instead of eating a
+                # socket.timeout exception every 2s; the stop_event is
+                # noticed within 0.1s instead of up to a whole recv timeout
+                sel = selectors.DefaultSelector()
+                sel.register(channel.fileno(), selectors.EVENT_READ)
+                try:
+                    while not stop_event.is_set():
+                        if not sel.select(0.1):
+                            continue
+                        try:
+                            raw_data = channel.recv(self.nb_bytes)
+                        except socket.timeout:
+                            continue
+                        if not raw_data:
                             break
-                        continue
-                    if not raw_data:
-                        break
-                    data = raw_data.decode("utf-8")
-                    if display:
-                        print(data, end='')
-                    if capture:
-                        output += data
-                    if stop_event.is_set():
-                        break
+                        data = raw_data.decode("utf-8")
+                        if display:
+                            print(data, end='')
+                        if capture:
+                            output += data
+                finally:
+                    sel.close()
 
             channel.close()
 
@@ -1094,6 +1759,8 @@ class ssh:
                 channel.get_pty()
             channel.exec_command(command)
 
+            buf = bytearray()  # capture, decoded once at the end
+            line_buf = bytearray()  # display, flushed at newline boundaries
             try:
                 if not display and not capture:
                     return channel.recv_exit_status(), output.splitlines()
@@ -1102,17 +1769,22 @@ class ssh:
                         raw_data = channel.recv(self.nb_bytes)
                         if not raw_data:
                             break
-                        data = raw_data.decode("utf-8")
-                        if display:
-                            re = "raspberrypi_code.raspberrypi.package.python.glt.org.py return "
-                            th = str(data).splitlines()
-                            tj = list()
-                            for gh in th:
-                                if gh.find(re) == -1 and not gh == "":
-                                    tj.append(gh + "\n")
-                            print("".join(tj), end='')
                         if capture:
-                            output += data
+                            buf += raw_data
+                        if display:
+                            line_buf += raw_data
+                            cut = line_buf.rfind(b"\n")
+                            if cut == -1:
+                                continue  # no complete line yet
+                            data = bytes(line_buf[:cut + 1]).decode("utf-8")
+                            del line_buf[:cut + 1]
+                            # keepends spares re-appending '\n' per kept
+                            # line (and the old str(data) was a no-op copy)
+                            print("".join(
+                                gh for gh in data.splitlines(keepends=True)
+                                if _MARKER not in gh and batch_re not in gh
+                                and gh.strip() != ""),
+                                end='')
             except socket.timeout:
                 logging.warning(f"Timeout after {timeout}s")
                 exit_code = 1
@@ -1122,6 +1794,12 @@ class ssh:
             else:
                 exit_code = channel.recv_exit_status()
             finally:
+                if display and line_buf:
+                    gh = bytes(line_buf).decode("utf-8")
+                    if _MARKER not in gh and batch_re not in gh:
+                        print(gh)
+                if capture:
+                    output = bytes(buf).decode("utf-8")
                 channel.close()
                 return exit_code, output.splitlines()
 
@@ -1155,19 +1833,39 @@ class ssh:
                 )
 
         def disconnect(self):
+            sftp_channel = self.__dict__.get("_sftp")
+            if sftp_channel is not None:
+                try:
+                    sftp_channel.close()
+                except Exception:
+                    pass
+                self._sftp = None
             if self.transport:
                 self.transport.close()
 
         def __getattr__(self, target):
+            if target.startswith("_"):
+                # private/dunder probes (copy, pickle, hasattr) are not
+                # remote sftp calls
+                raise AttributeError(target)
+
             def wrapper(*args, **kwargs):
                 if not self.transport.is_authenticated():
                     logging.error("SSH session is not ready")
                     return
-                sftp_channel = ssh.SFTPController.from_transport(
-                    self.transport)
-                r = getattr(sftp_channel, target)(*args, **kwargs)
-                sftp_channel.close()
-                return r
+                # one sftp subsystem channel per controller, opened on first
+                # use and kept for the life of the connection; opening and
+                # closing one per call cost two round-trips each time.  the
+                # lock makes the lazy open atomic and keeps concurrent run()
+                # threads off the channel at the same time - sftp channels
+                # are not thread safe (see the SFTPPool docstring)
+                with self._sftp_lock:
+                    sftp_channel = self.__dict__.get("_sftp")
+                    if sftp_channel is None or sftp_channel.sock.closed:
+                        sftp_channel = ssh.SFTPController.from_transport(
+                            self.transport)
+                        self._sftp = sftp_channel
+                    return getattr(sftp_channel, target)(*args, **kwargs)
 
             return wrapper
 
@@ -1178,116 +1876,340 @@ raspberrypi_prep_timeout = 1
 raspberrypi_ip = 0
 raspberrypi_info = list()
 
+ssh_mux_pool = dict()  # one authenticated connection per (user, host, port)
+ssh_mux_lock = threading.Lock()
+ssh_mux_idle = 600  # close multiplexed connections unused for 10 min
+
+
+def _close_ssh_mux_pool():
+    # pooled connections stay open between calls on purpose; drop them all
+    # at interpreter exit so the raspberrypi side isn't left holding
+    # half-open sessions until its own timeout fires
+    with ssh_mux_lock:
+        for ssh_controller, last_used in ssh_mux_pool.values():
+            try:
+                ssh_controller.disconnect()
+            except Exception:
+                pass
+        ssh_mux_pool.clear()
+
+
+atexit.register(_close_ssh_mux_pool)
+
+
+def _get_ssh_controller(host, user, password, port=22):
+    # reuse one live connection per (user, host, port) like OpenSSH
+    # ControlMaster/ControlPersist, so every decorated call after the first
+    # skips the TCP + SSH handshake and auth. Set RASPBERRY_CONTROL_NO_SSH_MUX
+    # to go back to one connection per call.
+    if os.environ.get("RASPBERRY_CONTROL_NO_SSH_MUX"):
+        ssh_controller = ssh.SSHController(
+            host=host,
+            user=user,
+            ssh_password=password,
+            port=port
+        )
+        ssh_controller.connect()
+        return ssh_controller
+    key = (user, host, port)
+    with ssh_mux_lock:
+        now = time.time()
+        if key in ssh_mux_pool:
+            ssh_controller, last_used = ssh_mux_pool[key]
+            if ssh_controller.transport is not None and ssh_controller.transport.is_active() and now - last_used < ssh_mux_idle:
+                ssh_mux_pool[key] = (ssh_controller, now)
+                return ssh_controller
+            ssh_controller.disconnect()
+        ssh_controller = ssh.SSHController(
+            host=host,
+            user=user,
+            ssh_password=password,
+            port=port
+        )
+        ssh_controller.connect()
+        ssh_mux_pool[key] = (ssh_controller, now)
+        return ssh_controller
+
+
+def _rewrite_remote_func(func):
+    # rewrite the function source for the raspberrypi side and give back the
+    # bare def. shared by the payload builder and raspberry_command_add so
+    # both ship the exact same rewrite
+    global imported
+    import ast
+    import inspect
+    import textwrap
+    import importlib
+
+    class Rewriter(ast.NodeTransformer):
+        # return X -> end(X) so the result come back over stdout, and
+        # global X -> X = <value from the user's module> because the
+        # raspberrypi side has no module to find the global in
+
+        def visit_FunctionDef(self, node):
+            return node  # leave returns inside nested defs alone
+
+        visit_AsyncFunctionDef = visit_FunctionDef
+
+        def visit_Return(self, node):
+            value = node.value
+            if value is None:
+                value = ast.Constant(value=None)
+            call = ast.Call(
+                func=ast.Name(id="end", ctx=ast.Load()),
+                args=[value],
+                keywords=[],
+            )
+            return ast.copy_location(ast.Expr(value=call), node)
+
+        def visit_Global(self, node):
+            stmts = []
+            for name in node.names:
+                try:
+                    value = getattr(importlib.import_module(imported), name)
+                    stmts.append(
+                        ast.parse("{} = {}".format(name, repr(value))).body[0]
+                    )
+                except Exception:
+                    # can't resolve it here, ship the statement as-is and
+                    # let the raspberrypi side complain like a local run
+                    stmts.append(ast.Global(names=[name]))
+            return stmts
+
+    tree = ast.parse(textwrap.dedent(inspect.getsource(func)))
+    fdef = tree.body[0]
+    fdef.decorator_list = []  # the decorator only exists on this side
+    body = []
+    for node in fdef.body:
+        node = Rewriter().visit(node)
+        if isinstance(node, list):  # a global statement can fan out
+            body.extend(node)
+        else:
+            body.append(node)
+    fdef.body = body
+    ast.fix_missing_locations(fdef)
+    return ast.unparse(fdef)
+
+
+def _build_remote_payload(func):
+    # turn the decorated function source into the file sent to the raspberrypi.
+    # the rewrite is pure function-of-the-source, so cache it on the function
+    # and only pay for the parse once per decorated function. helpers added by
+    # raspberry_command_add grow function_to_add, hence the length in the key
+    global function_to_add
+    global import_list
+    cached = getattr(func, "_rpi_src_cache", None)
+    if cached is not None and cached[0] is import_list and cached[1] == len(function_to_add):
+        return cached[2]
+    payload = (
+        'def end(mess):\n\tprint("raspberrypi_code.raspberrypi.package.python.glt.org.py return " + str(mess))\n'
+        + import_list + "\n" + "".join(function_to_add)
+        + _rewrite_remote_func(func) + "\n" + func.__name__ + "()"
+    )
+    func._rpi_src_cache = (import_list, len(function_to_add), payload)
+    return payload
+
+
+def _pack_remote_payload(func_content):
+    # compile here (fast desktop cpu) and ship the bytecode so the raspberrypi
+    # only exec it instead of parsing the source on its slow cpu. marshal
+    # format change between python versions so the source stay embedded and is
+    # compiled on the raspberrypi when it run another python than us
+    import sys
+    import marshal
+    import base64
+    try:
+        blob = base64.b64encode(marshal.dumps(
+            compile(func_content, "<raspberrypi_control>", "exec"))).decode()
+    except Exception:
+        return func_content
+    return (
+        "import sys, marshal, base64\n"
+        + "if sys.version_info[:2] == " + str(tuple(sys.version_info[:2])) + ":\n"
+        + "    exec(marshal.loads(base64.b64decode(" + repr(blob) + ")))\n"
+        + "else:\n"
+        + "    exec(compile(" + repr(func_content) + ", '<raspberrypi_control>', 'exec'))\n"
+    )
+
+
+prewarm_future = None  # set by config(), the connection opened in background
+
+
+def _prewarm_connection():
+    # open the multiplexed connection, run in a background thread by config()
+    global raspberrypi_prep
+    global raspberrypi_info
+    return _get_ssh_controller(
+        raspberrypi().local(raspberrypi_prep),
+        raspberrypi_info[0],
+        raspberrypi_info[1]
+    )
+
+
+def _get_connection():
+    # take the connection pre warmed by config() if there is one, else open
+    # (or reuse) one now
+    global prewarm_future
+    if prewarm_future is not None:
+        fut = prewarm_future
+        prewarm_future = None
+        try:
+            return fut.result()
+        except Exception:
+            pass
+    return _get_ssh_controller(
+        raspberrypi().local(raspberrypi_prep),
+        raspberrypi_info[0],
+        raspberrypi_info[1]
+    )
+
+
+# the stdout line carrying a remote return value, filtered from display
+_MARKER = "raspberrypi_code.raspberrypi.package.python.glt.org.py return "
+
+# every upload gets its own remote file name; concurrent run() calls used
+# to overwrite each other on one shared path between putfo and exec
+_upload_seq = itertools.count(1)
+
+
+def _remote_file_name():
+    return ("raspberrypi_code.raspberrypi.package.python.glt.org."
+            + str(os.getpid()) + "-" + str(next(_upload_seq)) + ".py")
+
+batch_pending = list()  # calls queued by @raspberry_command(batch=True)
+batch_re = "raspberrypi_code.raspberrypi.package.python.glt.org.py batch "
+
+
+def flush():
+    # ship every call queued with batch=True as one remote exec (one round
+    # trip for N calls) and split the output back per call on the batch marker
+    global batch_pending
+    global raspberrypi_prep
+    global raspberrypi_info
+    if not batch_pending:
+        return
+    pending = batch_pending
+    batch_pending = list()
+    try:
+        ssh_controller = _get_connection()
+        parts = list()
+        gh = 0
+        for fut, func, args, kwargs in pending:
+            parts.append(_build_remote_payload(func))
+            parts.append('\nprint("' + batch_re + str(gh) + '")\n')
+            gh = gh + 1
+        func_content = _pack_remote_payload("".join(parts))
+        # create stream; sending bytes with the size up front lets sftp
+        # pipeline fixed chunks instead of reading a text buffer to EOF
+        file_name = _remote_file_name()
+        data = func_content.encode("utf-8")
+        buf = BytesIO(data)
+        # send stream to raspberrypi
+        ssh_controller.putfo(buf, file_name, file_size=len(data))
+        # launch the code sent and delete it in the same shell, the cleanup
+        # used to be a separate sftp round-trip
+        exit_code, output = ssh_controller.run(
+            command="python " + file_name + "; rm -f " + file_name,
+            display=True,
+            capture=True
+        )
+        # split the output back per call
+        re = "raspberrypi_code.raspberrypi.package.python.glt.org.py return "
+        results = list()
+        current = None
+        for line in output:
+            if line.find(batch_re) != -1:
+                results.append(current)
+                current = None
+            elif line.find(re) != -1:
+                current = line.replace(re, "")
+        for gh in range(len(pending)):
+            if gh < len(results):
+                pending[gh][0].set_result(results[gh])
+            else:
+                pending[gh][0].set_result(None)
+    except Exception as f:  # if raspberrypi not find it's will be run in local on the computer
+        for fut, func, args, kwargs in pending:
+            # one call blowing up must not leave the other futures hanging
+            # forever (flush also run from atexit), so keep the error in
+            # the future of the call it belong to
+            try:
+                fut.set_result(func(*args, **kwargs))
+            except Exception as e:
+                fut.set_exception(e)
+
+
+atexit.register(flush)
+
+
+def run(*calls):
+    # run more than one decorated function at the same time, the network wait
+    # of one overlap the other (two 200ms call take ~200ms and not 400ms).
+    # use like run(test, other) and you get the outputs in the same order
+    with ThreadPoolExecutor(max_workers=len(calls)) as ex:
+        futs = list()
+        for call in calls:
+            futs.append(ex.submit(call))
+        return [fut.result() for fut in futs]
+
 
-def raspberry_command():
+def _payload_for(func):
+    # rewritten source + bytecode pack are a pure function of the source and
+    # of config(), so pay for them once per decorated function instead of
+    # once per call. config() rebinds import_list, hence the identity key,
+    # and raspberry_command_add grows function_to_add, hence the length
+    cached = getattr(func, "_rpi_payload", None)
+    if cached is not None and cached[0] is import_list and cached[1] == len(function_to_add):
+        return cached[2]
+    payload = _pack_remote_payload(_build_remote_payload(func))
+    func._rpi_payload = (import_list, len(function_to_add), payload)
+    return payload
+
+
+def raspberry_command(batch=False):
     def decorator(func):
+        try:
+            # warm the cache at decoration time; if config() runs later the
+            # key check above rebuilds with the real import block
+            _payload_for(func)
+        except Exception:
+            pass  # no reachable source yet (interactive), build at call time
+
         @wraps(func)
         def wrapper(*args, **kwargs):
+            if batch:
+                # queue the call, flush() will ship everything queued in one
+                # remote exec and the Future give the output after
+                fut = Future()
+                batch_pending.append((fut, func, args, kwargs))
+                return fut
+            flush()  # keep the order with calls already queued by batch=True
             try:
                 global raspberrypi_prep
                 global raspberrypi_info
-                global imported
-                global function_to_add
-                ssh_controller = ssh.SSHController(
-                    host=raspberrypi().local(raspberrypi_prep),
-                    user=raspberrypi_info[0],
-                    ssh_password=raspberrypi_info[1]
-                )
-                ssh_controller.connect()
-                import inspect
-                func_content = inspect.getsource(func)
-                func_content = func_content.splitlines(True)
-                func_contentl = list()
-                ft = 0
-                func_name = ""
-                ft = 0
-
-                for sv in func_content:
-                    if not add:
-                        if sv.find("return") == -1 and ft != 1 and ft != 0 and not sv.find("global") == 4:
-                            func_contentl.append(sv)
-                        elif sv.find("global") == 4 and sv.find("return") == -1 and ft != 1 and ft != 0:
-                            res = {}
-                            try:
-                                res = {}
-                                exec("from " + imported + " import " + sv.replace("global ", "").replace(" ", "", sv.replace("global ", "").count(
-                                    " ")) + "result = " + sv.replace("global ", "").replace(" ", "", sv.replace("global ", "").count(" ")), globals(), res)
-                                func_contentl.append(sv.replace("global ", "").replace(
-                                    "\n", "") + " = " + str(res["result"]) + "\n")
-                            except Exception as e:
-                                res["result"] = sv
-                                func_contentl.append(sv.replace(
-                                    "\n", "") + " = " + str(res["result"]) + "\n")
-                        elif sv.find("return") == -1 and ft == 1 and ft != 0 and not sv.find("global") == 4:
-                            rep = sv.split()
-                            rept = 0
-                            for sf in rep:
-                                if rept == 1:
-                                    func_name = sf.replace(":", "")
-                                rept = rept + 1
-                            func_contentl.append(sv)
-                        elif sv.find("return") != -1 and ft != 0 and ft != 1 and not sv.find("global") == 4:
-                            func_contentl.append(sv.replace(
-                                "\n", "").replace("return ", "end(") + ")")
-                        ft = ft + 1
-                    else:
-                        if sv.find("return") == -1 and ft != 1 and ft != 2 and ft != 0 and not sv.find("global") == 4:
-                            func_contentl.append(sv)
-                        elif sv.find("global") == 4 and sv.find("return") == -1 and ft != 1 and ft != 0 and ft != 2:
-                            res = {}
-                            try:
-                                res = {}
-                                exec("from " + imported + " import " + sv.replace("global ", "").replace(" ", "",
-                                                                                                         sv.replace(
-                                                                                                             "global ",
-                                                                                                             "").count(
-                                                                                                             " ")) + "result = " + sv.replace(
-                                    "global ", "").replace(" ", "", sv.replace("global ", "").count(" ")), globals(),
-                                    res)
-                                func_contentl.append(
-                                    sv.replace("global ", "").replace("\n", "") + " = " + str(res["result"]) + "\n")
-                            except Exception as e:
-                                res["result"] = sv
-                                func_contentl.append(sv.replace(
-                                    "\n", "") + " = " + str(res["result"]) + "\n")
-                        elif sv.find("return") == -1 and ft == 2 and ft != 1 and ft != 0 and not sv.find("global") == 4:
-                            rep = sv.split()
-                            rept = 0
-                            for sf in rep:
-                                if rept == 1:
-                                    func_name = sf.replace(":", "")
-                                rept = rept + 1
-                            func_contentl.append(sv)
-                        elif sv.find("return") != -1 and ft != 0 and ft != 1 and ft != 2 and not sv.find("global") == 4:
-                            func_contentl.append(sv.replace(
-                                "\n", "").replace("return ", "end(") + ")")
-                        ft = ft + 1
-                # add runner thing
-                global import_list
-                func_contentl.insert(0,
-                                     'def end(mess):\n\tprint("raspberrypi_code.raspberrypi.package.python.glt.org.py return " + str(mess))\n' + import_list + "\n" + "".join(function_to_add))
-                func_contentl.append("\n" + func_name)
-                func_content = "".join(func_contentl)
-                # create stream
-                file_name = "raspberrypi_code.raspberrypi.package.python.glt.org.py"
-                buf = StringIO(func_content)
+                ssh_controller = _get_connection()
+                func_content = _payload_for(func)
+                # create stream; bytes + known size, same reason as flush()
+                file_name = _remote_file_name()
+                data = func_content.encode("utf-8")
+                buf = BytesIO(data)
                 # send stream to raspberrypi
-                ssh_controller.putfo(buf, file_name)
-                # launch the code sent
+                ssh_controller.putfo(buf, file_name, file_size=len(data))
+                # launch the code sent and delete it in the same shell, the
+                # cleanup used to be a separate sftp round-trip (a disconnect
+                # also sat after the return below, dead since day one; the
+                # pooled connection is meant to stay open anyway)
                 exit_code, output = ssh_controller.run(
-                    command="python " + file_name,
+                    command="python " + file_name + "; rm -f " + file_name,
                     display=True,
                     capture=True
                 )
-                # delete the code sent
-                ssh_controller.remove(file_name)
                 # send the return value
                 re = "raspberrypi_code.raspberrypi.package.python.glt.org.py return "
                 if output[-1].find(re) != -1:
                     return output[-1].replace(re, "")
                 else:
                     return None
-                ssh_controller.disconnect()
             except Exception as f:  # if raspberrypi not find it's will be run in local on the computer
                 return func(*args, **kwargs)
 
@@ -1300,51 +2222,12 @@ def raspberry_command_add():
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            import inspect
             global function_to_add
-            func_data = inspect.getsource(func)
-            func_data = func_data.splitlines(True)
-            func_datal = list()
-            em = list()
-            ct = 0
-            for g in func_data:
-                if not ct == 0:
-                    em.append(g)
-                ct += 1
-            ft = 0
-            for sv in func_data:
-                if sv.find("return") == -1 and ft != 1 and ft != 0 and not sv.find("global") == 4:
-                    func_datal.append(sv)
-                elif sv.find("global") == 4 and sv.find("return") == -1 and ft != 1 and ft != 0:
-                    # add global variable to the run
-                    res = {}
-                    try:
-                        res = {}
-                        exec("from " + imported + " import " + sv.replace("global ", "").replace(" ", "",
-                                                                                                 sv.replace(
-                                                                                                     "global ",
-                                                                                                     "").count(
-                                                                                                     " ")) + "result = " + sv.replace(
-                            "global ", "").replace(" ", "", sv.replace("global ", "").count(" ")), globals(), res)
-                        func_datal.append(
-                            sv.replace("global ", "").replace("\n", "") + " = " + str(res["result"]) + "\n")
-                    except Exception as e:
-                        res["result"] = sv
-                        func_datal.append(sv.replace(
-                            "\n", "") + " = " + str(res["result"]) + "\n")
-                elif sv.find("return") == -1 and ft == 1 and ft != 0 and not sv.find("global") == 4:
-                    rep = sv.split()
-                    rept = 0
-                    for sf in rep:
-                        if rept == 1:
-                            func_name = sf.replace(":", "")
-                        rept = rept + 1
-                    func_datal.append(sv)
-                elif sv.find("return") != -1 and ft != 0 and ft != 1 and not sv.find("global") == 4:
-                    func_datal.append(sv.replace(
-                        "\n", "").replace("return ", "end(") + ")")
-                ft = ft + 1
-            function_to_add.append("".join(function_to_add))
+            # same ast rewrite as raspberry_command, so the helper def that
+            # land in the payload handle return/global the same way. the old
+            # line scanner appended a join of the list instead of the scanned
+            # source, so helpers never made it to the raspberrypi at all
+            function_to_add.append(_rewrite_remote_func(func) + "\n")
             return True
 
         return wrapper
@@ -1379,6 +2262,16 @@ def timeout(seconds, default=None):
     return decorator
 
 
+# one compiled regex instead of the find/replace chain per line; handles
+# 'import a', 'import a, b', 'import a as c' and 'from a.b import x'
+_IMPORT_RE = re.compile(
+    r'^\s*(?:from\s+([\w\.]+)\s+import'
+    r'|import\s+([\w\.]+(?:\s+as\s+\w+)?(?:\s*,\s*[\w\.]+(?:\s+as\s+\w+)?)*))')
+# file path -> (mtime, rendered import block); config() can run more than
+# once and the file rarely change between calls
+_import_scan_cache = {}
+
+
 def config(file_name):
     # read file_name
     if file_name[-3:-1] == ".py":  # check if file name content .py at end
@@ -1388,48 +2281,94 @@ def config(file_name):
     imported = file_name
     # make list of all import
     global import_list
-    import_list_finish = list()
-    file = open(file_name + ".py", "r").read().splitlines()
-    for imp in file:
-        if imp.find("import ") != -1 and imp.find("import raspberrypi") == -1 and imp.replace("import ",
-                                                                                              "") != "" and imp.replace(
-                "import ", "") != " ":
-            imp = imp.split(" ")
-            imp = imp[1]
-            import_list.append(imp)
-    # generate the code to add
-    for item in import_list:
-        if not item == "" and not item == " ":
-            item_res = ["'pip install " + item + "'", "import " + item,
-                        "try:\n\timport " + item + "\nexcept:\n\timport os\n\t" + "os.system('pip install " + item + "')\n\timport " + item]
-            import_list_finish.append(item_res)
-    import_list_end = list()
-    for thing in import_list_finish:
-        import_list_end.append(thing[2])
-    import_list = "\n".join(import_list_end)
+    src_path = file_name + ".py"
+    mtime = os.stat(src_path).st_mtime
+    cached = _import_scan_cache.get(src_path)
+    if cached is not None and cached[0] == mtime:
+        import_list = cached[1]
+    else:
+        names = list()
+        for imp in open(src_path, "r").read().splitlines():
+            m = _IMPORT_RE.match(imp)
+            if m is None:
+                continue
+            if m.group(1) is not None:  # from a.b import x -> a
+                found = [m.group(1)]
+            else:  # import a as c, b.d -> a, b
+                found = [part.split()[0]
+                         for part in m.group(2).split(",")]
+            for item in found:
+                item = item.split(".")[0]
+                if not item.startswith("raspberrypi") and item not in names:
+                    names.append(item)
+        import_list_end = list()
+        for item in names:
+            if item in sys.stdlib_module_names:
+                # already on the raspberrypi, no point wrapping it in a
+                # pip install fallback
+                import_list_end.append("import " + item)
+            else:
+                import_list_end.append(
+                    "try:\n\timport " + item + "\nexcept:\n\timport os\n\t"
+                    + "os.system('pip install " + item + "')\n\timport " + item)
+        import_list = "\n".join(import_list_end)
+        _import_scan_cache[src_path] = (mtime, import_list)
+    # pre open the ssh connection in the background so the first decorated
+    # call find the handshake already done
+    global prewarm_future
+    if raspberrypi_info and prewarm_future is None:
+        ex = ThreadPoolExecutor(max_workers=1)
+        prewarm_future = ex.submit(_prewarm_connection)
+        ex.shutdown(wait=False)
 
 
 class raspberrypi:
     global raspberrypi_prep_timeout
 
-    @timeout(raspberrypi_prep_timeout, default=False)
+    _instance = None
+
+    def __new__(cls):
+        # the class only hold global config, so keep one instance instead of
+        # building a fresh object on every raspberrypi() call
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def _tcp_probe(self, hoip):
+        # cheap reachability knock on port 22; the kernel enforces the
+        # timeout so this is safe to run from worker threads (no SIGALRM)
+        global raspberrypi_prep_timeout
+        try:
+            socket.create_connection(
+                (hoip, 22), timeout=raspberrypi_prep_timeout).close()
+            return True
+        except OSError:
+            return False
+
     def check(self, hoip):
+        # no SIGALRM here: the deadline is enforced at the socket/transport
+        # level, so check can run from the local() worker threads
         global raspberrypi_info
+        global raspberrypi_prep_timeout
+        if not self._tcp_probe(hoip):
+            return False  # nothing listening, skip the SSH handshake
         HOST_IP = hoip
         SSH_PWD = raspberrypi_info[1]
 
         ssh_controller = ssh.SSHController(
             host=HOST_IP,
             user=raspberrypi_info[0],
-            ssh_password=SSH_PWD
+            ssh_password=SSH_PWD,
+            timeout=raspberrypi_prep_timeout
         )
-        ssh_controller.connect()
         try:
+            if ssh_controller.connect() != 0:
+                return False
             ssh_controller.run(
                 command="ls"
             )
             return True
-        except:
+        except (OSError, paramiko.SSHException):
             return False
 
     def set_preparation(self, ip, max_loop, timeout_time):
@@ -1446,20 +2385,20 @@ class raspberrypi:
         global raspberrypi_prep
         start_ip = raspberrypi_prep
         if raspberrypi_ip == 0 and raspberrypi_prep == start_ip:
-            gh = 0
-            gj = []
-            while True:
-                gj.append(start_ip + str(gh))
-                gh = gh + 1
-                if gh == int(raspberrypi_prep_max):
-                    break
-            for host in gj:
-                hoip = host
-                if raspberrypi().check(hoip):
-                    raspberrypi_ip = hoip
-                    break
-                else:
-                    continue
+            gj = [start_ip + str(gh)
+                  for gh in range(int(raspberrypi_prep_max))]
+            # knock on every host at once instead of one after the other;
+            # the scan is network bound so the wall clock becomes the
+            # slowest host instead of the sum of all of them
+            with ThreadPoolExecutor(max_workers=len(gj)) as ex:
+                futs = {ex.submit(self.check, hoip): hoip
+                        for hoip in gj}
+                for fut in as_completed(futs):
+                    if fut.result():
+                        raspberrypi_ip = futs[fut]
+                        for other in futs:
+                            other.cancel()
+                        break
         res = raspberrypi_ip
         if res != 0:
             return res
@@ -1473,6 +2412,15 @@ class raspberrypi:
         raspberrypi_info.append(password)
 
 
+def configure(user_name, password, ip, max_loop=8, timeout_time=1):
+    # one call doing set_raspberry_info + set_preparation + local together
+    rpi = raspberrypi()
+    rpi.set_raspberry_info(user_name, password)
+    rpi.set_preparation(ip, max_loop, timeout_time)
+    rpi.local(ip)
+    return rpi
+
+
 def run_command(command=None, display=False):
     if not command == None:
         global raspberrypi_prep
@@ -1515,12 +2463,10 @@ class file:
             ssh_password=raspberrypi_info[1]
         )
         ssh_controller.connect()
-        buffer = StringIO("")
+        buffer = BytesIO()
         content = ssh_controller.getfo(name, buffer)
         buffer.seek(0)
-        buffer.write(buffer.read()[2:-2])
-        buffer.seek(0)
-        self.file_content = buffer
+        self.file_content = StringIO(buffer.read().decode())
         ssh_controller.disconnect()
 
     def get(self):